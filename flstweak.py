@@ -42,17 +42,140 @@ import binascii
 import sys
 import os
 import argparse
+import mmap
+import ctypes
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from fastcrc import crc32 as fastcrc32  # Optional SIMD-accelerated CRC-32
+except ImportError:
+    fastcrc32 = None
 
 MAGIC_WORD = 0xA0FFFF9F
 HEADER_SIZE_W80X = 64
 HEADER_SIZE_W60X = 56
 W60X_HEADER_PADDING = 200
-W60X_HEADER_PADDING_CRC = 0x947D8E12
+W60X_HEADER_PADDING_DATA = b'\xFF' * W60X_HEADER_PADDING
+W60X_EMPTY_HEADER = b'\xFF' * HEADER_SIZE_W60X
+PADDING_CHUNK_SIZE = 0x10000
+PARALLEL_CRC_MIN_SIZE = 0x400000
+CRC32_POLYNOMIAL = 0xEDB88320  # Reflected
+UINT32_STRUCT = struct.Struct("<I")
 VERSION = str(2.0)
 
 
-def crc32(data):
-    return (~binascii.crc32(data) & 0xFFFFFFFF)  # CRC-32/JAMCRC format
+def crc32(data, checksum=0xFFFFFFFF):
+    if fastcrc32:
+        return fastcrc32.jamcrc(data, checksum)
+    return (~binascii.crc32(data, ~checksum & 0xFFFFFFFF) & 0xFFFFFFFF)  # CRC-32/JAMCRC format
+
+
+class W80xHeader(ctypes.LittleEndianStructure):
+    _pack_ = 1
+    _fields_ = [
+        ("magic", ctypes.c_uint32),
+        ("img_attr", ctypes.c_uint32),
+        ("img_addr", ctypes.c_uint32),
+        ("img_len", ctypes.c_uint32),
+        ("img_header_addr", ctypes.c_uint32),
+        ("upgrade_img_addr", ctypes.c_uint32),
+        ("org_checksum", ctypes.c_uint32),
+        ("upd_no", ctypes.c_uint32),
+        ("ver", ctypes.c_uint8 * 16),
+        ("reserved0", ctypes.c_uint32),
+        ("reserved1", ctypes.c_uint32),
+        ("next_img_addr", ctypes.c_uint32),
+        ("hd_checksum", ctypes.c_uint32),
+    ]
+
+
+class W60xHeader(ctypes.LittleEndianStructure):
+    _pack_ = 1
+    _fields_ = [
+        ("magic", ctypes.c_uint32),
+        ("img_attr", ctypes.c_uint32),
+        ("img_addr", ctypes.c_uint32),
+        ("img_len", ctypes.c_uint32),
+        ("org_checksum", ctypes.c_uint32),
+        ("upgrade_img_addr", ctypes.c_uint32),
+        ("upgrade_img_len", ctypes.c_uint32),
+        ("upgrade_img_checksum", ctypes.c_uint32),
+        ("upd_no", ctypes.c_uint32),
+        ("ver", ctypes.c_uint8 * 16),
+        ("hd_checksum", ctypes.c_uint32),
+    ]
+
+
+def crc32_multmodp(a, b):
+    # Multiplies a and b modulo the CRC-32 polynomial, ported from zlib
+    m = 1 << 31
+    p = 0
+    while True:
+        if a & m:
+            p ^= b
+            if (a & (m - 1)) == 0:
+                break
+        m >>= 1
+        b = (b >> 1) ^ CRC32_POLYNOMIAL if b & 1 else b >> 1
+    return p
+
+
+CRC32_X2N_TABLE = [1 << 30]  # x^(2^n) modulo the CRC-32 polynomial
+for _ in range(31):
+    CRC32_X2N_TABLE.append(crc32_multmodp(CRC32_X2N_TABLE[-1], CRC32_X2N_TABLE[-1]))
+
+
+def crc32_combine(checksum1, checksum2, length2):
+    # Combines the checksums of two consecutive blocks into the checksum of both blocks
+    p = 1 << 31
+    k = 3  # x^(8 * length2)
+    while length2:
+        if length2 & 1:
+            p = crc32_multmodp(CRC32_X2N_TABLE[k & 31], p)
+        length2 >>= 1
+        k += 1
+    return crc32_multmodp(p, ~checksum1 & 0xFFFFFFFF) ^ checksum2
+
+
+def crc32_chunk_count(data):
+    # Large data is split into one chunk per CPU
+    thread_count = os.cpu_count() or 1
+    return thread_count if len(data) > PARALLEL_CRC_MIN_SIZE else 1
+
+
+def crc32_submit(executor, data):
+    # Returns a list of (future, length) for the chunks of data checksummed concurrently
+    chunk_count = crc32_chunk_count(data)
+    if chunk_count < 2:
+        return [(executor.submit(crc32, data), len(data))]
+
+    view = memoryview(data)
+    chunk_size = (len(view) // chunk_count + 63) & ~63  # All chunks but the last are a multiple of 64 bytes long
+    chunks = [view[i:i + chunk_size] for i in range(0, len(view), chunk_size)]
+    return [(executor.submit(crc32, chunk), len(chunk)) for chunk in chunks]
+
+
+def crc32_result(checksums):
+    checksum = checksums[0][0].result()
+    for future, length in checksums[1:]:
+        checksum = crc32_combine(checksum, future.result(), length)
+    return checksum
+
+
+def crc32_parallel(data):
+    chunk_count = crc32_chunk_count(data)
+    if chunk_count < 2:
+        return crc32(data)
+
+    with ThreadPoolExecutor(chunk_count) as executor:
+        return crc32_result(crc32_submit(executor, data))
+
+
+def read_view(firmware, length):
+    position = firmware.tell()
+    length = min(length, len(firmware) - position)
+    firmware.seek(position + length)
+    return memoryview(firmware)[position:position + length]
 
 
 def detect_firmware_type(file):
@@ -62,7 +185,7 @@ def detect_firmware_type(file):
     if len(header_data) < HEADER_SIZE_W60X:
         raise ValueError("[Error] Invalid header, wrong size")
 
-    test_crc32 = struct.unpack("<I", header_data[52:56])[0]
+    test_crc32 = UINT32_STRUCT.unpack_from(header_data, 52)[0]
     data_crc32 = crc32(header_data[:52])
 
     file.seek(original_position)
@@ -74,145 +197,262 @@ def detect_firmware_type(file):
         raise ValueError("[Error] Unknown firmware type or corrupted header.")
 
 
-def validate_header(header, header_size, hd_checksum):
-    data_size = header_size - 4
-    checksum = crc32(header[:data_size])
-    if checksum != hd_checksum:
-        raise ValueError(f"  [Error] Invalid header, checksum verification failed (expected 0x{hd_checksum:08X}, actual 0x{checksum:08X})")
-    return True
+def find_bytes(body, ref_data, start=0, body_start=0):
+    # Views of the mapped firmware are searched in place, body_start is the offset of the view in the mapping
+    if isinstance(body, memoryview):
+        ref_index = body.obj.find(ref_data, body_start + start, body_start + len(body))
+        return ref_index - body_start if ref_index != -1 else -1
+    return body.find(ref_data, start)
+
+
+def patch_data(body, splices, start, end):
+    data = bytearray(body[start:end])
+    for offset, mod_data in splices:
+        patch_start, patch_end = max(offset, start), min(offset + len(mod_data), end)
+        if patch_start < patch_end:
+            data[patch_start - start:patch_end - start] = mod_data[patch_start - offset:patch_end - offset]
+    return data
+
 
+def find_data(body, splices, ref_data, body_start=0):
+    # Finds the first match in the body as modified by the splices
+    ref_len = len(ref_data)
+    ref_index = find_bytes(body, ref_data, 0, body_start)
+    while ref_index != -1 and any(offset < ref_index + ref_len and ref_index < offset + len(mod_data) for offset, mod_data in splices):
+        ref_index = find_bytes(body, ref_data, ref_index + 1, body_start)
 
-def replace_data(body, ref_data, mod_data):
-    ref_index = body.find(ref_data)
+    for offset, mod_data in splices: # Earlier replacements can introduce new matches
+        window_start = max(offset - ref_len + 1, 0)
+        window_index = patch_data(body, splices, window_start, offset + len(mod_data) + ref_len - 1).find(ref_data)
+        if window_index != -1 and (ref_index == -1 or window_start + window_index < ref_index):
+            ref_index = window_start + window_index
+    return ref_index
+
+
+def replace_data(body, splices, ref_data, mod_data, body_start=0):
+    # Records the replacement as a splice of (offset, data) instead of copying the body
+    ref_index = find_data(body, splices, ref_data, body_start)
     if ref_index == -1:
-        return body, False
-    return body[:ref_index] + mod_data + body[ref_index + len(ref_data):], True
+        return False
+
+    start, end = ref_index, ref_index + len(mod_data)
+    overlapping = [splice for splice in splices if splice[0] < end and start < splice[0] + len(splice[1])]
+    if overlapping:
+        start = min(start, overlapping[0][0])
+        end = max(end, max(offset + len(data) for offset, data in overlapping))
+        merged_data = patch_data(body, splices, start, end)
+        merged_data[ref_index - start:ref_index - start + len(mod_data)] = mod_data
+        splices[:] = [splice for splice in splices if splice not in overlapping]
+        splices.append((start, merged_data))
+    else:
+        splices.append((ref_index, mod_data))
+    splices.sort()
+    return True
 
 
-def parse_img_attr(img_attr, firmware_type):
-    img_type = img_attr & 0xF                # Bits 0-3
-    code_encrypt = (img_attr >> 4) & 0x1     # Bit 4
-    prikey_sel = (img_attr >> 5) & 0x7       # Bits 5-7
-    signature = (img_attr >> 8) & 0x1        # Bit 8
-    reserved1 = (img_attr >> 9) & 0x7F       # Bits 9-15
-    gzip_enable = (img_attr >> 16) & 0x1     # Bit 16
-    erase_block_en = (img_attr >> 17) & 0x1  # Bit 17
-    erase_always = (img_attr >> 18) & 0x1    # Bit 18
-    compress_type = (img_attr >> 19) & 0x3   # Bits 19-20
-    reserved2 = (img_attr >> 21) & 0x7FF     # Bits 21-31
-
-    img_type_mapping = {
-        0x0: "Bootloader",
-        0x1: "User image",
-        0x2: "Partition table",
-        0xE: "Factory test program"
-    }
-    img_type_str = f"{img_type_mapping.get(img_type, 'Unknown')} (0x{img_type:X})"
+def load_replacements(replace_target):
+    # Returns a list of (name, ref_data, mod_data) for a reference file or directory of reference files
+    if os.path.isdir(replace_target):
+        ref_files = [f for f in os.listdir(replace_target) if f.endswith('ref.bin')]
+        if not ref_files:
+            raise ValueError("No reference files found in specified directory.")
+
+        replacements = []
+        for ref_file in ref_files:
+            mod_file = ref_file.replace("ref.bin", "mod.bin")
+            ref_path = os.path.join(replace_target, ref_file)
+            mod_path = os.path.join(replace_target, mod_file)
+
+            if not os.path.exists(mod_path):
+                print(f"[Warning] No matching mod file for {ref_file}, skipping.")
+                continue
+
+            with open(ref_path, "rb") as ref_input, open(mod_path, "rb") as mod_input:
+                ref_data, mod_data = ref_input.read(), mod_input.read()
+                if len(ref_data) != len(mod_data):
+                    print(f"[Error] Reference and modification files must be the same size: {ref_file}")
+                    continue
+            ref_name, _ = os.path.splitext(ref_file)
+            replacements.append((ref_name, ref_data, mod_data))
+        return replacements
+
+    elif os.path.isfile(replace_target) and replace_target.endswith('ref.bin'):
+        ref_filename = replace_target
+        mod_filename = replace_target.replace("ref.bin", "mod.bin")
+        if not os.path.exists(mod_filename):
+            raise ValueError(f"Matching modification file not found for {ref_filename}")
+
+        with open(ref_filename, "rb") as ref_file, open(mod_filename, "rb") as mod_file:
+            ref_data, mod_data = ref_file.read(), mod_file.read()
+
+            if len(ref_data) != len(mod_data):
+                raise ValueError("Reference and modification files must be the same size.")
+
+        ref_name, _ = os.path.splitext(ref_filename)
+        return [(ref_name, ref_data, mod_data)]
 
-    if firmware_type == "W60x":
-        return {
-            "Type": img_type_str,
-            "GZIP compression": bool(gzip_enable),
-            "Compression type": compress_type,
-        }
     else:
-        return {
-            "Type": img_type_str,
-            "Encryption": bool(code_encrypt),
-            "Encryption private key #": prikey_sel,
-            "Signature": bool(signature),
-            #"Reserved 1": reserved1,
-            "GZIP compression": bool(gzip_enable),
-            "Block erase": bool(erase_block_en),
-            "Always erase": bool(erase_always),
-            "Compression type": compress_type,
-            #"Reserved 2": reserved2,
-        }
+        raise ValueError("Invalid replacement reference file or directory.")
+
+
+def replace_data_multi(body, replacements, body_start=0):
+    replaced_files = {}
+    splices = []
+    for ref_name, ref_data, mod_data in replacements:
+        replaced_files[ref_name] = replace_data(body, splices, ref_data, mod_data, body_start)
+    return splices, replaced_files
+
+
+def crc32_spliced(body, splices):
+    view = memoryview(body)
+    checksum = 0xFFFFFFFF
+    cursor = 0
+    for offset, mod_data in splices:
+        checksum = crc32(mod_data, crc32(view[cursor:offset], checksum))
+        cursor = offset + len(mod_data)
+    return crc32(view[cursor:], checksum)
+
+
+def copy_data(output_file, view, start, length, input_fd, body_start):
+    if input_fd is not None and hasattr(os, 'sendfile'):
+        output_file.flush()
+        while length > 0:
+            try:
+                sent = os.sendfile(output_file.fileno(), input_fd, body_start + start, length)
+            except OSError: # Some platforms can only send to sockets
+                break
+            if not sent:
+                break
+            start += sent
+            length -= sent
+    output_file.write(view[start:start + length])
+
+
+def write_data(output_file, body, splices, input_fd=None, body_start=0):
+    # Unmodified ranges are copied directly from the input file where supported
+    view = memoryview(body)
+    cursor = 0
+    for offset, mod_data in splices + [(len(view), b'')]:
+        copy_data(output_file, view, cursor, offset - cursor, input_fd, body_start)
+        output_file.write(mod_data)
+        cursor = offset + len(mod_data)
+
+
+def skip_padding(firmware):
+    start = firmware.tell()
+    end = len(firmware)
+    position = start
+    while position < end:
+        chunk = firmware[position:position + PADDING_CHUNK_SIZE]
+        padding_len = len(chunk) - len(chunk.lstrip(b'\xFF'))
+        position += padding_len
+        if padding_len < len(chunk):
+            break
+
+    # Padding is skipped in 4-byte words, a trailing partial word is consumed
+    position = start + (position - start) // 4 * 4
+    if end - position < 4:
+        position = end
+    firmware.seek(position)
+
+
+IMG_TYPES = {
+    0x0: "Bootloader",
+    0x1: "User image",
+    0x2: "Partition table",
+    0xE: "Factory test program"
+}
+
+
+def format_img_type(img_type):
+    return f"{IMG_TYPES.get(img_type, 'Unknown')} (0x{img_type:X})"
+
+
+# Image attribute fields: name, bit shift, bit mask, display conversion
+IMG_ATTR_FIELDS_W80X = (
+    ("Type", 0, 0xF, format_img_type),          # Bits 0-3
+    ("Encryption", 4, 0x1, bool),               # Bit 4
+    ("Encryption private key #", 5, 0x7, int),  # Bits 5-7
+    ("Signature", 8, 0x1, bool),                # Bit 8
+    #("Reserved 1", 9, 0x7F, int),              # Bits 9-15
+    ("GZIP compression", 16, 0x1, bool),        # Bit 16
+    ("Block erase", 17, 0x1, bool),             # Bit 17
+    ("Always erase", 18, 0x1, bool),            # Bit 18
+    ("Compression type", 19, 0x3, int),         # Bits 19-20
+    #("Reserved 2", 21, 0x7FF, int),            # Bits 21-31
+)
+IMG_ATTR_FIELDS_W60X = tuple(field for field in IMG_ATTR_FIELDS_W80X if field[0] in ("Type", "GZIP compression", "Compression type"))
+
+
+def parse_img_attr(img_attr, firmware_type):
+    fields = IMG_ATTR_FIELDS_W60X if firmware_type == "W60x" else IMG_ATTR_FIELDS_W80X
+    return tuple((name, convert((img_attr >> shift) & mask)) for name, shift, mask, convert in fields)
 
 
 def print_image_info(firmware_type, header, body_len, body_checksum, replaced=False, new_hd_checksum=None, new_org_checksum=None):
-    img_attr = header[1]
-    img_attr_parsed = parse_img_attr(header[1], firmware_type)
-    img_addr = header[2]
-    img_len = header[3]
-    if firmware_type == "W60x":
-        org_checksum = header[4]
-        upgrade_img_addr = header[5]
-        upgrade_img_len = header[6]
-        upgrade_img_checksum = header[7]
-        upd_no = header[8]
-        ver = header[9].decode('ascii').strip('\x00')
-        hd_checksum = header[10]
-    else:
-        img_header_addr = header[4]
-        upgrade_img_addr = header[5]
-        org_checksum = header[6]
-        upd_no = header[7]
-        ver = header[8].decode('ascii').strip('\x00')
-        reserved0 = header[9]
-        reserved1 = header[10]
-        next_img_addr = header[11]
-        hd_checksum = header[12]
+    img_attr_parsed = parse_img_attr(header.img_attr, firmware_type)
+    img_len = header.img_len
+    org_checksum = header.org_checksum
+    hd_checksum = header.hd_checksum
+    ver = bytes(header.ver).decode('ascii').strip('\x00')
 
     # Parse header fields
-    print("  Image attributes:")
-    for key, value in img_attr_parsed.items():
-        print(f"    {key}: {value}")
-    print(f"  Image address: 0x{img_addr:08X}")
+    lines = ["  Image attributes:"]
+    for key, value in img_attr_parsed:
+        lines.append(f"    {key}: {value}")
+    lines.append(f"  Image address: 0x{header.img_addr:08X}")
     if img_len != body_len:
-        print(f"  Image size: expected {img_len}, actual {body_len} [INVALID]")
+        lines.append(f"  Image size: expected {img_len}, actual {body_len} [INVALID]")
     else:
-        print(f"  Image size: {img_len}")
+        lines.append(f"  Image size: {img_len}")
     if firmware_type == "W60x":
-        print(f"  OTA update address: 0x{upgrade_img_addr:08X}")
-        print(f"  OTA update size: {upgrade_img_len}")
-        print(f"  OTA update checksum: 0x{upgrade_img_checksum:08X}")
-        print(f"  OTA update version: 0x{upd_no:08X}")
-        print(f"  Version: {ver}")
+        lines.append(f"  OTA update address: 0x{header.upgrade_img_addr:08X}")
+        lines.append(f"  OTA update size: {header.upgrade_img_len}")
+        lines.append(f"  OTA update checksum: 0x{header.upgrade_img_checksum:08X}")
+        lines.append(f"  OTA update version: 0x{header.upd_no:08X}")
+        lines.append(f"  Version: {ver}")
     else:
-        print(f"  Header address: 0x{img_header_addr:08X}")
-        print(f"  OTA update address: 0x{upgrade_img_addr:08X}")
-        print(f"  OTA update version: 0x{upd_no:08X}")
-        print(f"  Version: {ver}")
-        #print(f"  Reserved 0: 0x{reserved0:08X}")
-        #print(f"  Reserved 1: 0x{reserved1:08X}")
-        print(f"  Next image header address: 0x{next_img_addr:08X}")
+        lines.append(f"  Header address: 0x{header.img_header_addr:08X}")
+        lines.append(f"  OTA update address: 0x{header.upgrade_img_addr:08X}")
+        lines.append(f"  OTA update version: 0x{header.upd_no:08X}")
+        lines.append(f"  Version: {ver}")
+        #lines.append(f"  Reserved 0: 0x{header.reserved0:08X}")
+        #lines.append(f"  Reserved 1: 0x{header.reserved1:08X}")
+        lines.append(f"  Next image header address: 0x{header.next_img_addr:08X}")
 
     if replaced:
-        print(f"  Image checksum: original 0x{org_checksum:08X}, new 0x{new_org_checksum:08X} (verified)")
-        print(f"  Header checksum: original 0x{hd_checksum:08X}, new 0x{new_hd_checksum:08X} (verified)")
+        lines.append(f"  Image checksum: original 0x{org_checksum:08X}, new 0x{new_org_checksum:08X} (verified)")
+        lines.append(f"  Header checksum: original 0x{hd_checksum:08X}, new 0x{new_hd_checksum:08X} (verified)")
     else:
         if org_checksum != body_checksum:
-            print(f"  Image checksum: expected 0x{org_checksum:08X}, actual 0x{body_checksum:08X} [INVALID]")
+            lines.append(f"  Image checksum: expected 0x{org_checksum:08X}, actual 0x{body_checksum:08X} [INVALID]")
         else:
-            print(f"  Image checksum: 0x{org_checksum:08X} (verified)")
-        print(f"  Header checksum: 0x{hd_checksum:08X} (verified)")
+            lines.append(f"  Image checksum: 0x{org_checksum:08X} (verified)")
+        lines.append(f"  Header checksum: 0x{hd_checksum:08X} (verified)")
+
+    sys.stdout.write("\n".join(lines) + "\n")
 
 
-def process_image(file, firmware_type, image_number, replace_target, output_file, extract):
+def read_image(file, firmware_type, image_number):
     image_increment = 1
     if firmware_type == "W60x":
+        header_class = W60xHeader
         header_size = HEADER_SIZE_W60X
-        header_data = file.read(header_size)
-        if crc32(header_data) == 0x27445404: #W60X data can be padded with 0xFF
-            while True:
-                padding_test = file.read(4)
-                if len(padding_test) < 4:
-                    break
-                if padding_test != b'\xFF\xFF\xFF\xFF':
-                    file.seek(-4,1)
-                    break
-            header_data = file.read(header_size)
+        header_data = read_view(file, header_size)
+        if header_data == W60X_EMPTY_HEADER: #W60X data can be padded with 0xFF
+            skip_padding(file)
+            header_data = read_view(file, header_size)
     else:
+        header_class = W80xHeader
         header_size = HEADER_SIZE_W80X
-        header_data = file.read(header_size)
+        header_data = read_view(file, header_size)
 
     image_prefix = ""
 
     if firmware_type == "W60x" and image_number == 1: # Checks if the image is a wrapper around additional images
         if not header_data or len(header_data) == 0:
             file.seek(56)
-            header_data = file.read(header_size)
+            header_data = read_view(file, header_size)
             image_number = 0.0
             image_increment = 0.1
 
@@ -220,36 +460,47 @@ def process_image(file, firmware_type, image_number, replace_target, output_file
         if not header_data or len(header_data) == 0:
             return None
 
-    print(f"\nImage {image_prefix}{image_number}:")
+    # Locates the image body, header and body are both views of the mapped firmware and validated by process_image()
+    body_start, body = None, None
+    if len(header_data) == header_size and UINT32_STRUCT.unpack_from(header_data)[0] == MAGIC_WORD:
+        img_len = UINT32_STRUCT.unpack_from(header_data, header_class.img_len.offset)[0]
+        if firmware_type == "W60x":
+            file_position = file.tell()
+            filler_test = read_view(file, W60X_HEADER_PADDING) # W60x firmware can have images padded with 0xFF
+            if filler_test != W60X_HEADER_PADDING_DATA:
+                file.seek(file_position)
 
-    magic_data = struct.unpack("<I", header_data[:4])[0]
+        body_start = file.tell()
+        body = read_view(file, img_len)
+
+    return f"{image_prefix}{image_number}", image_number + image_increment, header_data, body_start, body
+
+
+def process_image(firmware_type, image, replacements, output_file, extract, firmware_fd=None, body_checksum=None):
+    image_number, next_image_number, header_data, body_start, body = image
+    header_class = W60xHeader if firmware_type == "W60x" else W80xHeader
+    header_size = HEADER_SIZE_W60X if firmware_type == "W60x" else HEADER_SIZE_W80X
+
+    print(f"\nImage {image_number}:")
+
+    if len(header_data) < UINT32_STRUCT.size: # Trailing data too short to hold a magic word
+        raise ValueError(f"  [Error] Invalid header, incorrect size (expected {header_size} bytes, actual {len(header_data)})")
+
+    magic_data = UINT32_STRUCT.unpack_from(header_data)[0]
     if magic_data != MAGIC_WORD:
         raise ValueError(f"  [Error] Invalid header, incorrect magic word (expected 0x{MAGIC_WORD:08X}, actual 0x{magic_data:08X})")
 
     if len(header_data) != header_size:
         raise ValueError(f"  [Error] Invalid header, incorrect size (expected {header_size} bytes, actual {len(header_data)})")
 
-    if firmware_type == "W60x":
-        header = struct.unpack("<IIIIIIIII16sI", header_data)
-        img_len, org_checksum, hd_checksum = header[3], header[4], header[10]
-        validate_header(struct.pack("<IIIIIIIII16sI", *header), header_size, hd_checksum)
-    else:
-        header = struct.unpack("<IIIIIIII16sIIII", header_data)
-        img_len, org_checksum, hd_checksum = header[3], header[6], header[12]
-        validate_header(struct.pack("<IIIIIIII16sIIII", *header), header_size, hd_checksum)
-
-    if firmware_type == "W60x":
-        file_position = file.tell()
-        filler_test = file.read(W60X_HEADER_PADDING) # W60x firmware can have images padded with 0xFF
-        if crc32(filler_test) == W60X_HEADER_PADDING_CRC:
-            file.seek(file_position + W60X_HEADER_PADDING)
-        else:
-            file.seek(file_position)
-        body = file.read(img_len)
-    else:
-        body = file.read(img_len)
+    header = header_class.from_buffer_copy(header_data)
+    img_len, org_checksum, hd_checksum = header.img_len, header.org_checksum, header.hd_checksum
+    checksum = crc32(header_data[:header_size - 4])
+    if checksum != hd_checksum:
+        raise ValueError(f"  [Error] Invalid header, checksum verification failed (expected 0x{hd_checksum:08X}, actual 0x{checksum:08X})")
 
-    body_checksum = crc32(body)
+    if body_checksum is None:
+        body_checksum = crc32_parallel(body)
     body_len = len(body)
     if body_len != img_len or body_checksum != org_checksum:
         valid_body = False
@@ -257,73 +508,26 @@ def process_image(file, firmware_type, image_number, replace_target, output_file
         valid_body = True
 
     replaced = False
-    if replace_target and valid_body:
-        if os.path.isdir(replace_target):
-            ref_files = [f for f in os.listdir(replace_target) if f.endswith('ref.bin')]
-            if not ref_files:
-                raise ValueError("No reference files found in specified directory.")
-
-            replaced_files = {}
-            for ref_file in ref_files:
-                mod_file = ref_file.replace("ref.bin", "mod.bin")
-                ref_path = os.path.join(replace_target, ref_file)
-                mod_path = os.path.join(replace_target, mod_file)
-
-                if not os.path.exists(mod_path):
-                    print(f"[Warning] No matching mod file for {ref_file}, skipping.")
-                    continue
-
-                with open(ref_path, "rb") as ref_input, open(mod_path, "rb") as mod_input:
-                    ref_data, mod_data = ref_input.read(), mod_input.read()
-                    if len(ref_data) != len(mod_data):
-                        print(f"[Error] Reference and modification files must be the same size: {ref_file}")
-                        continue
-
-                if replaced:
-                    new_body, replaced = replace_data(new_body, ref_data, mod_data)
-                    replaced_files[ref_file] = replaced
-                    replaced = True
-                else:
-                    new_body, replaced = replace_data(body, ref_data, mod_data)
-                    replaced_files[ref_file] = replaced
-
-        elif os.path.isfile(replace_target) and replace_target.endswith('ref.bin'):
-            ref_filename = replace_target
-            mod_filename = replace_target.replace("ref.bin", "mod.bin")
-            if not os.path.exists(mod_filename):
-                raise ValueError(f"Matching modification file not found for {ref_filename}")
-
-            with open(ref_filename, "rb") as ref_file, open(mod_filename, "rb") as mod_file:
-                ref_data, mod_data = ref_file.read(), mod_file.read()
-
-                if len(ref_data) != len(mod_data):
-                    raise ValueError("Reference and modification files must be the same size.")
-
-            ref_name, _ = os.path.splitext(ref_filename)
-            new_body, replaced = replace_data(body, ref_data, mod_data)
-
-        else:
-            raise ValueError("Invalid replacement reference file or directory.")
+    if replacements is not None and valid_body:
+        splices, replaced_files = replace_data_multi(body, replacements, body_start)
+        replaced = any(replaced_files.values())
 
         if replaced:
-            new_org_checksum = crc32(new_body)
-            new_header = list(header)
-            new_header[6] = new_org_checksum
-            new_header[12] = crc32(struct.pack("<IIIIIIII16sIII", *new_header[:12]))
-            output_file.write(struct.pack("<IIIIIIII16sIIII", *new_header))
-            output_file.write(new_body)
-            print_image_info(firmware_type, header, body_len, body_checksum, True, new_header[12], new_org_checksum)
+            new_org_checksum = crc32_spliced(body, splices)
+            header_buffer = bytearray(header_data)
+            new_header = W80xHeader.from_buffer(header_buffer)
+            new_header.org_checksum = new_org_checksum
+            new_hd_checksum = new_header.hd_checksum = crc32(memoryview(header_buffer)[:header_size - 4])
+            output_file.write(header_buffer)
+            write_data(output_file, body, splices, firmware_fd, body_start)
+            print_image_info(firmware_type, header, body_len, body_checksum, True, new_hd_checksum, new_org_checksum)
         else:
-            output_file.write(struct.pack("<IIIIIIII16sIIII", *header))
-            output_file.write(body)
+            output_file.write(header_data)
+            write_data(output_file, body, [], firmware_fd, body_start)
             print_image_info(firmware_type, header, body_len, body_checksum, False)
 
-        if os.path.isdir(replace_target):
-            for replaced_item, matched in replaced_files.items():
-                ref_name, _ = os.path.splitext(replaced_item)
-                print(f"  [Replace] {'Matched and replaced' if matched else 'Not matched'}: {ref_name}")
-        else:
-            print(f"  [Replace] {'Matched and replaced' if replaced else 'Not matched'}: {ref_name}")
+        for ref_name, matched in replaced_files.items():
+            print(f"  [Replace] {'Matched and replaced' if matched else 'Not matched'}: {ref_name}")
 
     else:
         print_image_info(firmware_type, header, body_len, body_checksum, False)
@@ -332,16 +536,53 @@ def process_image(file, firmware_type, image_number, replace_target, output_file
         base_name, _ = os.path.splitext(args.filename)
         output = f"{base_name}_image{image_number}.img"
         with open(output, "wb") as image_file:
-            image_file.write(body)
+            write_data(image_file, body, [], firmware_fd, body_start)
         if replaced:
             mod_output = f"{base_name}_image{image_number}_mod.img"
             with open(mod_output, "wb") as image_file:
-                image_file.write(new_body)
+                write_data(image_file, body, splices, firmware_fd, body_start)
             print(f"  [Extract] Saved original image as {output}, modified image as {mod_output}")
         else:
             print(f"  [Extract] Saved image as {output}")
 
-    return image_number + image_increment
+    return next_image_number
+
+
+def process_images(firmware, firmware_type, replacements, output_file, extract, firmware_fd):
+    image_number = 0
+    while True:
+        try:
+            image = read_image(firmware, firmware_type, image_number)
+            if not image:
+                break
+            image_number = process_image(firmware_type, image, replacements, output_file, extract, firmware_fd)
+        except ValueError as e:
+            print(e)
+            break
+
+
+def process_images_parallel(firmware, firmware_type, extract, firmware_fd):
+    # Images are located first so their checksums can be calculated concurrently, CRC-32 releases the GIL
+    images = []
+    image_number = 0
+    while True:
+        image = read_image(firmware, firmware_type, image_number)
+        if not image:
+            break
+        images.append(image)
+        image_number = image[1]
+        if image[4] is None: # Invalid header, the next image cannot be located
+            break
+
+    # All images and chunks of large images share one pool, tasks are only submitted from this thread
+    with ThreadPoolExecutor() as executor:
+        checksums = [crc32_submit(executor, image[4]) if image[4] is not None else None for image in images]
+        for image, checksum in zip(images, checksums):
+            try:
+                process_image(firmware_type, image, None, None, extract, firmware_fd, checksum and crc32_result(checksum))
+            except ValueError as e:
+                print(e)
+                break
 
 
 def parse_firmware(args):
@@ -350,28 +591,15 @@ def parse_firmware(args):
             firmware_type = detect_firmware_type(file)
             print(f"Detected firmware type: {firmware_type}")
 
-            image_number = 0
-            if args.replace and firmware_type != "W60x":
-                output_filename = args.output or f"{os.path.splitext(args.filename)[0]}_mod.fls"
-                with open(output_filename, "wb") as output_file:
-                    while True:
-                        try:
-                            image_number = process_image(file, firmware_type, image_number, args.replace, output_file, args.extract)
-                            if not image_number:
-                                break
-                        except ValueError as e:
-                            print(e)
-                            break
-                    print(f"\n[Output] Saved processed firmware as {output_filename}")
-            else:
-                while True:
-                    try:
-                        image_number = process_image(file, firmware_type, image_number, None, None, args.extract)
-                        if not image_number:
-                            break
-                    except ValueError as e:
-                        print(e)
-                        break
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as firmware:
+                if args.replace and firmware_type != "W60x":
+                    replacements = load_replacements(args.replace)
+                    output_filename = args.output or f"{os.path.splitext(args.filename)[0]}_mod.fls"
+                    with open(output_filename, "wb") as output_file:
+                        process_images(firmware, firmware_type, replacements, output_file, args.extract, file.fileno())
+                        print(f"\n[Output] Saved processed firmware as {output_filename}")
+                else:
+                    process_images_parallel(firmware, firmware_type, args.extract, file.fileno())
 
     except FileNotFoundError as e:
         print(e)